@@ -6,6 +6,8 @@ rsync -avc \
  --exclude="photos*"\
  --exclude="log*"\
  --exclude="images*"\
+ --exclude="clips*"\
+ --exclude="background*"\
  --exclude="video*"\
  --exclude="__pycache__"\
  ~/Projects/speed/street-traffic/* \
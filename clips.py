@@ -0,0 +1,115 @@
+import queue
+import threading
+from collections import deque
+
+import cv2
+
+# Quality of frames held in memory; the ring stores JPEG bytes, not raw frames
+RING_JPEG_QUALITY = 80
+
+# MJPG is cheap to produce on the Pi and needs no encoder licensing/plugins
+CLIP_FOURCC = 'MJPG'
+CLIP_EXTENSION = 'avi'
+
+# Clips waiting for post-padding frames or for the writer thread.
+#  Further vehicles are skipped (and logged) until there is room.
+MAX_PENDING_CLIPS = 4
+
+class ClipRecorder (object):
+    'Keep a compressed ring of recent frames and write clips of fast vehicles in the background.'
+
+    def __init__ (self, directory, log, framerate, buffer_seconds=8, padding_seconds=1.0):
+        self.directory = directory
+        self.log = log
+        self.framerate = framerate
+        self.padding = int(round(padding_seconds * framerate))
+        self.ring = deque(maxlen=int(round(buffer_seconds * framerate)))
+        self.waiting = []
+        self.jobs = queue.Queue(maxsize=MAX_PENDING_CLIPS)
+        self.worker = threading.Thread(target=self.write_clips, name='clips', daemon=True)
+        self.worker.start()
+
+    def add_frame (self, frame_number, frame):
+        'Compress a frame into the ring, dropping the oldest frame when full'
+        ok, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, RING_JPEG_QUALITY])
+        if ok:
+            self.ring.append((frame_number, jpeg))
+
+    def vehicle_done (self, vehicle):
+        'Request a clip of the vehicle passage, once post-padding frames arrive'
+        if len(self.waiting) + self.jobs.qsize() >= MAX_PENDING_CLIPS:
+            self.log.warning('ClipRecorder: too many pending clips, skipping vehicle %d', vehicle.id)
+            return
+
+        first = vehicle.start_frame - self.padding
+        last = vehicle.done_frame + self.padding
+        self.waiting.append((first, last, vehicle.file_name(self.directory, CLIP_EXTENSION)))
+
+    def update (self, frame_number):
+        'Hand clips whose last frame has been seen to the writer thread'
+        ready = [w for w in self.waiting if w[1] <= frame_number]
+        for clip in ready:
+            self.waiting.remove(clip)
+            self.submit(*clip)
+
+    def submit (self, first, last, file_name):
+        frames = [jpeg for (n, jpeg) in self.ring if first <= n <= last]
+        if not frames:
+            self.log.warning('ClipRecorder: no frames in ring for %s', file_name)
+            return
+        if self.ring[0][0] > first:
+            self.log.debug('ClipRecorder: clip start truncated %s', file_name)
+        try:
+            self.jobs.put_nowait((file_name, frames))
+        except queue.Full:
+            self.log.warning('ClipRecorder: writer busy, dropping %s', file_name)
+
+    def write_clips (self):
+        'Writer thread: encode each queued clip, logging (not dying on) failures'
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+
+            file_name, frames = job
+            try:
+                self.write_clip(file_name, frames)
+            except Exception as e:
+                self.log.warning('ClipRecorder: unable to write %s: %s', file_name, e)
+
+    def write_clip (self, file_name, frames):
+        'Decode ring frames and encode them to a clip file'
+        writer = None
+        written = 0
+        try:
+            for jpeg in frames:
+                frame = cv2.imdecode(jpeg, cv2.IMREAD_COLOR)
+                if frame is None:
+                    continue
+
+                if writer is None:
+                    h, w = frame.shape[:2]
+                    fourcc = cv2.VideoWriter_fourcc(*CLIP_FOURCC)
+                    writer = cv2.VideoWriter(file_name, fourcc, self.framerate, (w, h))
+                    if not writer.isOpened():
+                        self.log.warning('ClipRecorder: unable to open %s', file_name)
+                        return
+
+                writer.write(frame)
+                written += 1
+        finally:
+            if writer is not None:
+                writer.release()
+
+        if written:
+            self.log.debug('ClipRecorder: saved %s (%d frames)', file_name, written)
+        else:
+            self.log.warning('ClipRecorder: no frames decoded for %s', file_name)
+
+    def stop (self):
+        'Write clips still waiting for padding with the frames available, then stop the writer'
+        for clip in self.waiting:
+            self.submit(*clip)
+        self.waiting = []
+        self.jobs.put(None)
+        self.worker.join()
@@ -1,15 +1,131 @@
+import os
+import time
+from enum import Enum
+
 import cv2
 
+# Running frame brightness (0-255 mean gray level) used to pick a detection mode.
+#  Exit levels are higher than enter levels so the mode doesn't flicker at dusk.
+LOW_LIGHT_ENTER_LEVEL = 70
+LOW_LIGHT_EXIT_LEVEL = 85
+NIGHT_ENTER_LEVEL = 35
+NIGHT_EXIT_LEVEL = 45
+
+# Weight of the newest frame in the running brightness estimate
+BRIGHTNESS_ALPHA = 0.02
+
+# Sample every Nth row/column when estimating brightness
+BRIGHTNESS_SAMPLE_STEP = 4
+
+# Low light: gain the strip up toward a target level. The gain follows the
+#  running brightness, so it changes slowly enough for the background model.
+#  (CLAHE was tried: its mapping jumps frame to frame and flags the whole strip.)
+TARGET_BRIGHTNESS = 100
+MAX_GAIN = 3.0
+# Smooth sensor noise first, or the gain lifts it past the background threshold
+LOW_LIGHT_BLUR_KERNEL = (3, 3)
+
+# Night: headlights are small, saturated cores. A top-hat keeps features
+#  smaller than the kernel, which drops the broad glow of the beams on the road.
+HEADLIGHT_TOPHAT_KERNEL = (15, 15)
+HEADLIGHT_THRESHOLD = 80
+# Sized so even a 2-3px light core grows past the Tracker's minimum new vehicle
+#  size (w > 48, h > 18 for 640x360), and lights a car length apart merge.
+HEADLIGHT_JOIN_KERNEL = (60, 20)
+
+# The KNN model needs several samples before a pixel counts as background,
+#  so a new model is primed by applying the same frame this many times.
+BG_PRIME_FRAMES = 6
+
+# Added preprocessing time allowed per frame (a 30 fps frame is ~33ms on the Pi)
+PREPROCESS_BUDGET_MS = 5.0
+PREPROCESS_REPORT_FRAMES = 900
+
 class Detector (object):
     'Detect moving objects that are potential vehicles.'
 
-    def __init__(self, initial_bg, log):
+    class Mode(Enum):
+        'Lighting conditions the detector is tuned for'
+        DAY = 'day'
+        LOW_LIGHT = 'low light' # dusk, heavy cloud
+        NIGHT = 'night' # headlights only
+
+    def __init__(self, initial_bg, log, night=False):
         self.log = log
+        self.force_night = night
+        self.mode = Detector.Mode.NIGHT if night else Detector.Mode.DAY
+        self.brightness = None
+        self.kernel_tophat = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, HEADLIGHT_TOPHAT_KERNEL)
+        self.kernel_join = cv2.getStructuringElement(cv2.MORPH_RECT, HEADLIGHT_JOIN_KERNEL)
+        self.preprocess_secs = 0.0
+        self.preprocess_frames = 0
+        self.shape = None
+
         self.bg_subtractor = cv2.createBackgroundSubtractorKNN(
                 history=5, dist2Threshold=25.0, detectShadows=False)
         self.log.debug("Pre-training the background subtractor...")
         if initial_bg is not None and initial_bg.size:
-            self.bg_subtractor.apply(initial_bg, None, 1.0)
+            # The model is trained on gray frames (see process_mask)
+            if initial_bg.ndim == 3:
+                initial_bg = cv2.cvtColor(initial_bg, cv2.COLOR_BGR2GRAY)
+            self.shape = initial_bg.shape
+
+            # Start in the mode for this frame; hysteresis only applies after that
+            self.brightness = self.frame_brightness(initial_bg)
+            if not self.force_night:
+                self.mode = Detector.mode_for_brightness(self.brightness)
+            self.log.debug('Detector starting in %s mode (brightness %3.1f)',
+                self.mode.value, self.brightness)
+
+            if self.mode is Detector.Mode.LOW_LIGHT:
+                initial_bg = self.enhance(initial_bg)
+            self.reset_background(initial_bg)
+
+    def reset_background (self, gray):
+        'Start a new background model from a single gray frame'
+        self.bg_subtractor = cv2.createBackgroundSubtractorKNN(
+                history=5, dist2Threshold=25.0, detectShadows=False)
+        for _i in range(BG_PRIME_FRAMES):
+            self.bg_subtractor.apply(gray)
+
+    def snapshot_name (self, file_name):
+        'Snapshot file for the current mode; low light models hold gained frames'
+        root, ext = os.path.splitext(file_name)
+        return '%s_%s%s' % (root, self.mode.name.lower(), ext)
+
+    def restore_background (self, file_name, max_age_secs):
+        'Restart the model from a recent snapshot saved in the same mode. True if restored'
+        file_name = self.snapshot_name(file_name)
+        try:
+            age = time.time() - os.path.getmtime(file_name)
+        except OSError:
+            return False
+
+        if age > max_age_secs:
+            self.log.debug('Background snapshot %s is stale (%ds old)', file_name, age)
+            return False
+
+        background = cv2.imread(file_name, cv2.IMREAD_GRAYSCALE)
+        if background is None or background.shape != self.shape:
+            self.log.debug('Background snapshot %s unreadable or wrong size', file_name)
+            return False
+
+        self.reset_background(background)
+        self.log.debug('Restored background snapshot %s (%ds old)', file_name, age)
+        return True
+
+    def save_background (self, file_name):
+        'Save the current background model image so a restart can start from it'
+        background = self.bg_subtractor.getBackgroundImage()
+        if background is None:
+            return
+
+        # write then rename, so a crash never leaves a partial snapshot
+        file_name = self.snapshot_name(file_name)
+        root, ext = os.path.splitext(file_name)
+        tmp_name = root + '.tmp' + ext
+        if cv2.imwrite(tmp_name, background):
+            os.replace(tmp_name, file_name)
 
     def detect(self, frame):
         mask = self.process_mask(frame)
@@ -31,9 +147,115 @@ class Detector (object):
 
         return mask
 
+    @staticmethod
+    def frame_brightness (gray):
+        'Mean gray level of a subsampled frame'
+        step = BRIGHTNESS_SAMPLE_STEP
+        return cv2.mean(gray[::step, ::step])[0]
+
+    @staticmethod
+    def mode_for_brightness (brightness):
+        'Detection mode for a brightness level, ignoring hysteresis'
+        if brightness < NIGHT_ENTER_LEVEL:
+            return Detector.Mode.NIGHT
+        if brightness < LOW_LIGHT_ENTER_LEVEL:
+            return Detector.Mode.LOW_LIGHT
+        return Detector.Mode.DAY
+
+    def update_mode (self, gray):
+        'Update running brightness estimate and switch detection mode. True if mode changed'
+        level = self.frame_brightness(gray)
+
+        if self.brightness is None:
+            # No initial frame: the model is empty, so just pick the mode
+            self.brightness = level
+            if not self.force_night:
+                self.mode = Detector.mode_for_brightness(level)
+            return False
+
+        self.brightness += BRIGHTNESS_ALPHA * (level - self.brightness)
+
+        if self.force_night:
+            return False
+
+        mode = self.mode
+        if mode is Detector.Mode.NIGHT:
+            if self.brightness > NIGHT_EXIT_LEVEL:
+                mode = Detector.Mode.LOW_LIGHT
+        elif self.brightness < NIGHT_ENTER_LEVEL:
+            mode = Detector.Mode.NIGHT
+
+        if mode is Detector.Mode.LOW_LIGHT:
+            if self.brightness > LOW_LIGHT_EXIT_LEVEL:
+                mode = Detector.Mode.DAY
+        elif mode is Detector.Mode.DAY and self.brightness < LOW_LIGHT_ENTER_LEVEL:
+            mode = Detector.Mode.LOW_LIGHT
+
+        if mode is self.mode:
+            return False
+
+        self.log.info('Detector mode %s -> %s (brightness %3.1f)',
+            self.mode.value, mode.value, self.brightness)
+        self.mode = mode
+        return True
+
+    def enhance (self, gray):
+        'Boost a dim gray strip with a global gain toward the target level'
+        gain = min(max(TARGET_BRIGHTNESS / max(self.brightness, 1.0), 1.0), MAX_GAIN)
+        gray = cv2.blur(gray, LOW_LIGHT_BLUR_KERNEL)
+        return cv2.convertScaleAbs(gray, alpha=gain)
+
+    def headlight_mask (self, gray, motion_mask):
+        'Moving headlight/taillight blobs, with beam glow suppressed'
+        cores = cv2.morphologyEx(gray, cv2.MORPH_TOPHAT, self.kernel_tophat)
+        _ret, lights = cv2.threshold(cores, HEADLIGHT_THRESHOLD, 255, cv2.THRESH_BINARY)
+
+        # Ignore stationary lights (street lamps, porch lights)
+        lights = cv2.bitwise_and(lights, motion_mask)
+
+        # Join the lights of one vehicle into a single vehicle-sized blob
+        return cv2.dilate(lights, self.kernel_join, iterations = 1)
+
+    def report_preprocess_time (self, secs):
+        'Periodically log average added preprocessing time against the frame budget'
+        self.preprocess_secs += secs
+        self.preprocess_frames += 1
+        if self.preprocess_frames < PREPROCESS_REPORT_FRAMES:
+            return
+
+        avg_ms = 1000 * self.preprocess_secs / self.preprocess_frames
+        if avg_ms > PREPROCESS_BUDGET_MS:
+            self.log.warning('Detector %s preprocess %2.2fms/frame over budget (%2.2fms)',
+                self.mode.value, avg_ms, PREPROCESS_BUDGET_MS)
+        else:
+            self.log.debug('Detector %s preprocess %2.2fms/frame (brightness %3.1f)',
+                self.mode.value, avg_ms, self.brightness)
+        self.preprocess_secs = 0.0
+        self.preprocess_frames = 0
+
     def process_mask(self, frame):
         gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+        start = time.perf_counter()
+        changed = self.update_mode(gray)
+        if self.mode is Detector.Mode.LOW_LIGHT:
+            gray = self.enhance(gray)
+        elapsed = time.perf_counter() - start
+
+        # Low light feeds the model gained frames. On a mode change, restart the
+        #  model from this frame rather than flag the whole strip as foreground.
+        if changed:
+            self.reset_background(gray)
         mask = self.bg_subtractor.apply(gray)
+
+        if self.mode is Detector.Mode.NIGHT:
+            # Vehicle bodies are mostly invisible; track their lights instead
+            start = time.perf_counter()
+            mask = self.headlight_mask(gray, mask)
+            self.report_preprocess_time(elapsed + time.perf_counter() - start)
+            return mask
+
+        self.report_preprocess_time(elapsed)
         mask = self.filter_mask(mask)
         return mask
 
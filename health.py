@@ -0,0 +1,33 @@
+import gc
+import os
+
+class Health (object):
+    'Self-reported process resource usage, logged periodically to catch memory creep.'
+
+    def __init__ (self, log):
+        self.log = log
+        self.page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+        self.first_rss = None
+
+    def rss_bytes (self):
+        'Current resident set size, or None where /proc is unavailable'
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * self.page_size
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def report (self, frame_number, queues):
+        'Log RSS, tracked Python objects and the size of each named queue'
+        rss = self.rss_bytes()
+        if self.first_rss is None:
+            self.first_rss = rss
+
+        objects = len(gc.get_objects())
+        sizes = ' '.join('%s:%d' % (name, size) for name, size in queues.items())
+
+        if rss is None:
+            self.log.info('Health f#%d objects:%d %s', frame_number, objects, sizes)
+        else:
+            self.log.info('Health f#%d rss:%.1fMB (%+.1fMB) objects:%d %s',
+                frame_number, rss / 2**20, (rss - self.first_rss) / 2**20, objects, sizes)
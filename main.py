@@ -1,21 +1,46 @@
 import os
+import time
 import argparse
 from datetime import datetime
 
+# Startup time is measured from here to the first processed frame
+START_TIME = time.perf_counter()
+
 import cv2
 
 from log import Log
+from health import Health
+from quota import DiskQuota
+from clips import ClipRecorder
 from detector import Detector
 from tracker import Tracker
 from video import VideoSource
 
+IMPORT_TIME = time.perf_counter()
+
 LOG_TO_FILE = True
 
 IMAGE_DIR = 'images'
 PHOTO_DIR = 'photos'
-
-# (arbitrary) maximum value used before wrapping to zero 
-MAX_FRAME_NUMBER = 1000000
+CLIP_DIR = 'clips'
+
+# Background model snapshot, restored on restart if recent.
+#  Saved per detector mode, e.g. background_night.png
+BACKGROUND_FILE = 'background.png'
+BACKGROUND_MAX_AGE_SECONDS = 10 * 60
+BACKGROUND_SAVE_SECONDS = 60
+
+# Disk space allowed for saved images, oldest are deleted first
+IMAGE_DIR_MAX_BYTES = 2**30
+IMAGE_DIR_MAX_AGE_DAYS = 7
+PHOTO_DIR_MAX_BYTES = 4 * 2**30
+PHOTO_DIR_MAX_AGE_DAYS = 90
+CLIP_DIR_MAX_BYTES = 4 * 2**30
+CLIP_DIR_MAX_AGE_DAYS = 30
+
+# How often to enforce disk quotas and report resource usage
+QUOTA_CHECK_SECONDS = 10 * 60
+HEALTH_REPORT_SECONDS = 15 * 60
 
 # Time to wait between frames, 0=forever
 WAIT_TIME = 1 # 250 # ms
@@ -27,6 +52,11 @@ BLACK = (10, 10, 10)
 
 SPEED_LIMIT = 25
 
+# Save a video clip of vehicles at or above this speed (0 = no clips)
+CLIP_SPEED = SPEED_LIMIT + 10
+CLIP_BUFFER_SECONDS = 8
+CLIP_PADDING_SECONDS = 1.0
+
 VIDEO_RESOLUTION = (640, 360)
 VIDEO_FRAME_RATE = 30
 
@@ -83,15 +113,7 @@ def save_vehicle_photo (vehicle):
     thickness = 2
     cv2.putText(photo, text, position, cv2.FONT_HERSHEY_SIMPLEX, scale, color, thickness)
 
-    # embed data in photo filename
-    # use utc time
-    utcnow = datetime.utcnow()
-    time = utcnow.strftime('%Y-%m-%d-%H-%M-%S')
-    speed = vehicle.mph
-    direction = 'S' if vehicle.direction > 0 else 'N'  # TODO: make configurable
-    vehicle_type = 'V' # for now - more to be defined in future
-    file_name = '%s/%s_%2.1f_%c_%c_%d_%d.png' % (
-        PHOTO_DIR, time, speed, direction, vehicle_type, vehicle.center_frame, vehicle.id)
+    file_name = vehicle.file_name(PHOTO_DIR, 'png')
 
     # log.debug("Saving %s as '%s'", label, file_name)
     cv2.imwrite(file_name, photo)
@@ -122,13 +144,35 @@ def main ():
         VIDEO_FILE, log, use_pi_camera=use_pi_camera, resolution=resolution, 
         framerate=framerate, night=use_night_mode
     )
+    video_start_time = time.perf_counter()
     (_width, _height), framerate = video.start()
+    ready_time = time.perf_counter()
 
-    initial_bg = video.read()
-    detector = Detector(initial_bg, log)
+    initial_bg = crop(video.read())
+    detector = Detector(initial_bg, log, night=use_night_mode)
+    if use_fast_start:
+        detector.restore_background(BACKGROUND_FILE, BACKGROUND_MAX_AGE_SECONDS)
 
     tracker = Tracker(resolution, framerate, log)
 
+    quotas = [
+        DiskQuota(IMAGE_DIR, log, IMAGE_DIR_MAX_BYTES, IMAGE_DIR_MAX_AGE_DAYS),
+        DiskQuota(PHOTO_DIR, log, PHOTO_DIR_MAX_BYTES, PHOTO_DIR_MAX_AGE_DAYS),
+        DiskQuota(CLIP_DIR, log, CLIP_DIR_MAX_BYTES, CLIP_DIR_MAX_AGE_DAYS),
+    ]
+    health = Health(log)
+    # (some web cameras report 0 fps)
+    fps = framerate or VIDEO_FRAME_RATE
+    quota_check_frames = int(QUOTA_CHECK_SECONDS * fps)
+    health_report_frames = int(HEALTH_REPORT_SECONDS * fps)
+    background_save_frames = int(BACKGROUND_SAVE_SECONDS * fps)
+
+    clips = None
+    if clip_speed > 0:
+        clips = ClipRecorder(CLIP_DIR, log, fps,
+            buffer_seconds=CLIP_BUFFER_SECONDS, padding_seconds=CLIP_PADDING_SECONDS)
+
+    # Never wraps: vehicle ages and center/done frames compare across the whole run
     frame_number = 0
     overall_start_time = datetime.now()
 
@@ -137,17 +181,43 @@ def main ():
         if frame is None:
             continue
 
-        frame_number = frame_number + 1 if frame_number < MAX_FRAME_NUMBER else 0
+        frame_number += 1
+
+        if frame_number % background_save_frames == 0:
+            detector.save_background(BACKGROUND_FILE)
+
+        if frame_number % quota_check_frames == 0:
+            for quota in quotas:
+                quota.prune_in_background()
+
+        if frame_number % health_report_frames == 0:
+            health.report(frame_number, {
+                'video': video.queue_size(),
+                'vehicles': len(tracker.vehicles),
+                'clip_ring': len(clips.ring) if clips else 0,
+                'clip_jobs': clips.jobs.qsize() if clips else 0,
+            })
 
         # Crop frame to region of interest
         cropped_frame = crop(frame)
 
+        # Keep a clean copy of the strip (before tracking overlays) for clips
+        if clips:
+            clips.add_frame(frame_number, cropped_frame)
+
         # Detect moving vehicle-like objects
         matches, mask = detector.detect(cropped_frame)
         
         # Track moving objects over time
         vehicles = tracker.track(matches, frame_number, resolution, cropped_frame)
 
+        if frame_number == 1:
+            now = time.perf_counter()
+            log.info('Startup %1.3fs (imports %1.3fs, setup %1.3fs, video ready %1.3fs, '
+                'first frame %1.3fs)',
+                now - START_TIME, IMPORT_TIME - START_TIME, video_start_time - IMPORT_TIME,
+                ready_time - video_start_time, now - ready_time)
+
         # Display current video frame and resulting object mask image stacked vertically.
         result = cv2.vconcat([cropped_frame, cv2.cvtColor(mask, cv2.COLOR_GRAY2BGR)])
         cv2.imshow('Traffic', result)
@@ -166,6 +236,12 @@ def main ():
                 else:
                     log.debug('no center frame %d #f%d' % (vehicle.id, frame_number))
 
+                if clips and vehicle.mph >= clip_speed:
+                    clips.vehicle_done(vehicle)
+
+        if clips:
+            clips.update(frame_number)
+
         key = cv2.waitKey(1)
         if key == ord('q') or key == 27:
             log.debug('ESC or q key, stopping...')
@@ -173,6 +249,11 @@ def main ():
 
     log.debug('Closing video source...')
     video.stop()
+    detector.save_background(BACKGROUND_FILE)
+
+    if clips:
+        log.debug('Writing remaining clips...')
+        clips.stop()
 
     # display overall fps
     elapsed_time = (datetime.now() - overall_start_time).total_seconds()
@@ -194,6 +275,10 @@ if __name__ == '__main__':
         help='1 to use the Raspberry Pi camera')  
     ap.add_argument('-n', '--night', type=int, default=-1,
         help='1 for night mode')
+    ap.add_argument('-f', '--faststart', type=int, default=-1,
+        help='1 to restore the saved background model at startup')
+    ap.add_argument('-s', '--clipspeed', type=float, default=CLIP_SPEED,
+        help='minimum mph to save a video clip, 0 for no clips')
     args = vars(ap.parse_args())
 
     use_pi_camera = args['picamera'] > 0
@@ -204,6 +289,14 @@ if __name__ == '__main__':
     if use_night_mode:
         log.debug('Using night mode')
 
+    use_fast_start = args['faststart'] > 0
+    if use_fast_start:
+        log.debug('Using fast start')
+
+    clip_speed = args['clipspeed']
+    if clip_speed > 0:
+        log.debug('Saving clips of vehicles >= %2.1f mph', clip_speed)
+
     if use_pi_camera:
         VIDEO_FILE = None
     else:
@@ -217,4 +310,8 @@ if __name__ == '__main__':
         log.debug('Creating photo directory `%s`...', PHOTO_DIR)
         os.makedirs(PHOTO_DIR)
 
+    if clip_speed > 0 and not os.path.exists(CLIP_DIR):
+        log.debug('Creating clip directory `%s`...', CLIP_DIR)
+        os.makedirs(CLIP_DIR)
+
     main()
@@ -0,0 +1,68 @@
+import os
+import time
+import threading
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+class DiskQuota (object):
+    'Keep a directory of saved images within an age and size limit by deleting the oldest files.'
+
+    def __init__ (self, directory, log, max_bytes, max_age_days=None):
+        self.directory = directory
+        self.log = log
+        self.max_bytes = max_bytes
+        self.max_age_secs = max_age_days * SECONDS_PER_DAY if max_age_days else None
+        self.thread = None
+
+    def scan (self):
+        'List (mtime, size, path) of files in the directory, oldest first'
+        files = []
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.is_file(follow_symlinks=False):
+                        st = entry.stat(follow_symlinks=False)
+                        files.append((st.st_mtime, st.st_size, entry.path))
+        except FileNotFoundError:
+            return []
+
+        files.sort()
+        return files
+
+    def prune_in_background (self):
+        'Prune on a worker thread so frame processing never waits on the disk'
+        if self.thread is not None and self.thread.is_alive():
+            self.log.warning('DiskQuota %s: previous prune still running', self.directory)
+            return
+
+        self.thread = threading.Thread(target=self.prune, name='quota', daemon=True)
+        self.thread.start()
+
+    def prune (self):
+        'Delete files older than the age limit, then oldest files until under the size limit'
+        start = time.perf_counter()
+        files = self.scan()
+        total = sum(size for _mtime, size, _path in files)
+        cutoff = time.time() - self.max_age_secs if self.max_age_secs else None
+
+        removed = 0
+        freed = 0
+        for mtime, size, path in files:
+            too_old = cutoff is not None and mtime < cutoff
+            if not too_old and total <= self.max_bytes:
+                break
+
+            try:
+                os.remove(path)
+            except OSError as e:
+                self.log.warning('DiskQuota: unable to remove %s: %s', path, e)
+                continue
+
+            total -= size
+            removed += 1
+            freed += size
+
+        self.log.debug('DiskQuota %s: removed %d files (%d bytes), %d bytes remain, %1.3fs',
+            self.directory, removed, freed, total, time.perf_counter() - start)
+
+        return removed
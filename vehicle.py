@@ -52,6 +52,18 @@ class Vehicle ():
         else:
             return (x, y+h)
 
+    def file_name (self, directory, extension):
+        'File name for a saved photo or clip, with vehicle data embedded'
+        # use utc time
+        utcnow = datetime.utcnow()
+        time = utcnow.strftime('%Y-%m-%d-%H-%M-%S')
+        speed = self.mph
+        direction = 'S' if self.direction > 0 else 'N'  # TODO: make configurable
+        vehicle_type = 'V' # for now - more to be defined in future
+        return '%s/%s_%2.1f_%c_%c_%d_%d.%s' % (
+            directory, time, speed, direction, vehicle_type, self.center_frame or 0, self.id,
+            extension)
+
     def age (self, frame_number):
         'Vehicle age in frames'
         return frame_number - self.start_frame
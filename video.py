@@ -1,7 +1,9 @@
 import time
 import cv2
 
-from imutils.video import FileVideoStream, VideoStream
+# Wait for the first frame instead of sleeping a fixed time
+READY_TIMEOUT = 5.0 # seconds
+READY_POLL = 0.01 # seconds
 
 class VideoSource (object):
     def __init__ (self, video_file, log, use_pi_camera = True, resolution=(320, 200), framerate = 30, night = False):
@@ -18,11 +20,14 @@ class VideoSource (object):
     def start (self):
         if self.filename is not None:
             self.log.debug('Video file: %s', self.filename)
+            # imported here so the web camera path never loads imutils (~50ms);
+            #  any imutils import pays for the whole package
+            from imutils.video import FileVideoStream
             self.fvs = FileVideoStream(self.filename).start()
             self.stream = self.fvs.stream
-            time.sleep(1.0)
         else: 
             if self.use_pi_camera:
+                from imutils.video import VideoStream
                 self.log.debug('Pi Camera (%d %d)', self.resolution[0], self.resolution[1])
                 self.stream = VideoStream(src=0,
                     usePiCamera=True,                    
@@ -41,8 +46,28 @@ class VideoSource (object):
                 )
                 self.framerate = self.stream.get(cv2.CAP_PROP_FPS)
 
+        self.wait_ready()
         return self.resolution, self.framerate
 
+    def ready (self):
+        'True once a frame is available (web camera: once the device is open)'
+        if self.filename:
+            # not fvs.running()/more(): more() sleeps while the queue is empty
+            return self.fvs.Q.qsize() > 0 or self.fvs.stopped
+        if self.use_pi_camera:
+            return self.stream.read() is not None
+        return self.stream.isOpened()
+
+    def wait_ready (self):
+        'Poll until the first frame is available (or timeout)'
+        start = time.perf_counter()
+        while not self.ready():
+            if time.perf_counter() - start > READY_TIMEOUT:
+                self.log.warning('Video source not ready after %1.1fs', READY_TIMEOUT)
+                break
+            time.sleep(READY_POLL)
+        self.log.debug('Video source ready in %1.3fs', time.perf_counter() - start)
+
     def read(self):
         if self.filename:
             frame = self.fvs.read()
@@ -50,6 +75,12 @@ class VideoSource (object):
             frame = self.stream.read()
         return frame
 
+    def queue_size (self):
+        'Number of decoded frames waiting to be read'
+        if self.filename and self.fvs is not None:
+            return self.fvs.Q.qsize()
+        return 0
+
     def stop (self):
         if self.filename:
             self.fvs.stop()